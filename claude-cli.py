@@ -2,41 +2,183 @@
 
 import os
 import sys
+import atexit
 import json
-import requests
+import re
+import functools
+import hashlib
+import itertools
+import collections
+import pty
+import fcntl
+import select
 import signal
-import tempfile
+import termios
+from tty import setraw
+import threading
+import time
+import shutil
 import subprocess
-from typing import Optional, Union, List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Optional, Union, List, Dict, Tuple, Callable
 from pathlib import Path
-from prompt_toolkit import PromptSession
-from prompt_toolkit.history import FileHistory
-from prompt_toolkit.styles import Style
-from prompt_toolkit.formatted_text import HTML
-from rich.console import Console
-from rich.panel import Panel
-from rich.text import Text
+
+if TYPE_CHECKING:
+    # Only imported at runtime by the REPL; see StyledCLI._init_interactive
+    from prompt_toolkit.formatted_text import HTML
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Optional: faster JSON encoding/decoding when installed
+
+def json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+def json_loads(data: Union[bytes, str]):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Interpreters are resolved once, so running or checking a block skips the
+# PATH search on every fork. Python blocks fall back to this interpreter
+# where there is no `python` on PATH.
+BASH_PATH = shutil.which('bash') or '/bin/bash'
+PYTHON_PATH = shutil.which('python') or sys.executable
+
+# Only the last MAX_CAPTURE bytes of command output are kept in memory
+MAX_CAPTURE = 1 << 20
+TRUNCATED_MARKER = "...[truncated]...\n"
+
+# !share sends at most this many characters from each end of a block's output
+SHARE_HEAD = SHARE_TAIL = 4096
+
+def truncate_middle(text: str, head: int = SHARE_HEAD, tail: int = SHARE_TAIL) -> str:
+    """Keep the start and end of long text, marking what was cut."""
+    if len(text) <= head + tail:
+        return text
+    return text[:head] + "\n" + TRUNCATED_MARKER + text[-tail:]
+
+class CaptureBuffer:
+    """Accumulates command output, keeping only the last MAX_CAPTURE bytes."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.truncated = False
+
+    def append(self, chunk: bytes) -> None:
+        self.data += chunk
+        # Trim in batches so long outputs stay bounded
+        if len(self.data) > 2 * MAX_CAPTURE:
+            del self.data[:-MAX_CAPTURE]
+            self.truncated = True
+
+    def getvalue(self) -> str:
+        if len(self.data) > MAX_CAPTURE:
+            del self.data[:-MAX_CAPTURE]
+            self.truncated = True
+        prefix = TRUNCATED_MARKER if self.truncated else ""
+        return prefix + self.data.decode(errors='replace')
+
+class ResponseCache:
+    """
+    On-disk cache of replies keyed by the full request body, so asking the
+    exact same thing again (same prompt, history and message) is answered
+    locally. The least recently used entries beyond max_entries are dropped.
+    """
+
+    def __init__(self, path: Union[str, Path], max_entries: int = 1000):
+        import sqlite3  # only loaded when the cache is enabled
+
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(str(path))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key BLOB PRIMARY KEY, val TEXT, ts REAL)"
+        )
+
+    @staticmethod
+    def key(payload: Dict) -> bytes:
+        return hashlib.blake2b(json_dumps(payload), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[str]:
+        row = self.db.execute("SELECT val FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with self.db:
+            self.db.execute("UPDATE cache SET ts = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: bytes, text: str) -> None:
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, text, time.time()))
+            self.db.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY ts DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def close(self) -> None:
+        self.db.close()
+
+# Token counts are printed after every interaction; bind the formatter and
+# the static text once
+_FMT_COMMA = "{:,}".format
+TOKENS_USED_PREFIX = "\n[tokens]Tokens used in this interaction: "
+TOKENS_USED_SUFFIX = "[/tokens]"
 
 class TokenUsage:
+    # Prompt-cache writes and reads are billed relative to the base price
+    CACHE_WRITE_MULTIPLIER = 1.25
+    CACHE_READ_MULTIPLIER = 0.1
+
     def __init__(self):
         self.total_tokens = 0
+        self.cache_write_tokens = 0
+        self.cache_read_tokens = 0
         self.cost_per_million = 3.0  # $3 per million tokens
 
     def add_tokens(self, count: int) -> None:
         self.total_tokens += count
 
+    def add_cache_tokens(self, written: int, read: int) -> None:
+        """Record the part of total_tokens that was written to or read from the prompt cache."""
+        self.cache_write_tokens += written
+        self.cache_read_tokens += read
+
     def get_cost(self) -> float:
-        return (self.total_tokens / 1_000_000) * self.cost_per_million
+        uncached = self.total_tokens - self.cache_write_tokens - self.cache_read_tokens
+        weighted = (uncached
+                    + self.cache_write_tokens * self.CACHE_WRITE_MULTIPLIER
+                    + self.cache_read_tokens * self.CACHE_READ_MULTIPLIER)
+        return (weighted / 1_000_000) * self.cost_per_million
 
     def get_summary(self) -> str:
-        return f"Total tokens: {self.total_tokens:,}\nEstimated cost: ${self.get_cost():.4f}"
+        return f"Total tokens: {_FMT_COMMA(self.total_tokens)}\nEstimated cost: ${self.get_cost():.4f}"
+
+SYSTEM_PROMPT_TEMPLATE = """You are a Linux shell assistant alongside an active bash prompt. Help users write and understand shell commands and scripts.
+
+Key points:
+- Always use ```bash code blocks for commands
+- Each command block should be self-contained and executable
+- Explain what commands do before or after the code blocks
+- Multiple command blocks are fine - users can select which to run
+
+The user will execute suggested blocks using a special !run <all | select> command.
+They can then share the output with you using a !share command.
+
+Current context:
+Directory: {cwd}"""
 
 class Config:
     def __init__(self):
         self.check_dependencies()
         self.check_environment()
-        self.history_file = self.init_history()
+        self.history_dir = self.init_history()
         self.token_usage = TokenUsage()
+        self._system_prompt_cwd = None
+        self._system_prompt = None
 
     @staticmethod
     def check_dependencies() -> None:
@@ -53,47 +195,73 @@ class Config:
             sys.exit(1)
 
     @staticmethod
-    def init_history() -> str:
+    def init_history() -> Path:
+        """Create the CLI's data directory if needed."""
         history_dir = Path.home() / '.claude-cli'
         history_dir.mkdir(exist_ok=True)
-        history_file = history_dir / 'history.json'
-        if not history_file.exists():
-            history_file.write_text('[]')
-        return str(history_file)
-
-    @staticmethod
-    def get_system_prompt() -> str:
-        return f"""You are a Linux shell assistant alongside an active bash prompt. Help users write and understand shell commands and scripts.
+        return history_dir
 
-Key points:
-- Always use ```bash code blocks for commands
-- Each command block should be self-contained and executable
-- Explain what commands do before or after the code blocks
-- Multiple command blocks are fine - users can select which to run
-
-The user will execute suggested blocks using a special !run <all | select> command.
-They can then share the output with you using a !share command.
-
-Current context:
-Directory: {os.getcwd()}"""
+    def get_system_prompt(self, cwd: str) -> str:
+        """
+        Return the system prompt for cwd, rebuilt only when cwd differs from
+        the previous call. A different directory also means a different
+        prompt prefix, so the server-side prompt cache starts over.
+        """
+        if cwd != self._system_prompt_cwd:
+            self._system_prompt = SYSTEM_PROMPT_TEMPLATE.format(cwd=cwd)
+            self._system_prompt_cwd = cwd
+        return self._system_prompt
 
 class History:
+    # A fenced block: an opening ``` line tagged with a supported language,
+    # then everything up to the next line that is a bare closing ```.
+    # Fences with any other tag are skipped, as are their closing lines.
+    _FENCE_RE = re.compile(
+        r'^[^\S\n]*```[^\S\n]*(bash|shell|sh|python)[^\S\n]*\n(.*?)^[^\S\n]*```[^\S\n]*$',
+        re.MULTILINE | re.DOTALL | re.IGNORECASE
+    )
+    # Other fence tags for the languages blocks are run with
+    _LANGUAGE_ALIASES = {'sh': 'bash', 'shell': 'bash'}
+    # Characters that make a bash command worth a real syntax check:
+    # operators, grouping, expansions, tests and quoting can all be
+    # left unbalanced, while plain words cannot
+    _BASH_META_RE = re.compile(r'[\n&|;<>()$`{}\[\]\'"]')
+
+    # Number of recent interactions sent to the API as context
+    API_CONTEXT_INTERACTIONS = 10
+    # Once the context is full, this many of its oldest interactions are
+    # dropped together. Sliding one at a time would change the start of
+    # every request, so no cached prompt prefix could ever be read back.
+    API_CONTEXT_TRIM_STEP = 5
+    # Input budget for a request, counted with estimate_tokens. Kept well
+    # under the model's context window since the estimate is approximate.
+    MAX_CONTEXT_TOKENS = 150_000
+    CHARS_PER_TOKEN = 4
+    # Interactions kept in memory (and written by !save); older ones drop off
+    MAX_SESSION_INTERACTIONS = 200
+
     def __init__(self):
-        self.session_history = []
+        self.session_history = collections.deque(maxlen=self.MAX_SESSION_INTERACTIONS)
+        # API-shaped messages for the recent interactions, maintained as
+        # interactions are added rather than rebuilt on every turn
+        self._api_messages = []
 
-    def test_command(self, command: str, language: str = 'bash') -> Tuple[bool, str]:
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def test_command(command: str, language: str = 'bash') -> Tuple[bool, str]:
         """
         Test if a command has valid syntax without executing it.
-        Returns a tuple of (is_valid, error_message).
+        Returns a tuple of (is_valid, error_message). Results are cached, so
+        a block seen again (re-parsed history, repeated !run) costs no fork.
         """
         if language == 'bash':
             # If it's a single-line command without special chars, consider it valid
-            if '\n' not in command and not any(c in command for c in '&|;<>()'):
+            if not History._BASH_META_RE.search(command):
                 return True, ""
 
             try:
                 process = subprocess.run(
-                    ['bash', '-n'],
+                    [BASH_PATH, '-n'],
                     input=command,
                     text=True,
                     capture_output=True
@@ -118,65 +286,84 @@ class History:
         Extract and optionally validate commands from code blocks.
         Returns a list of tuples: (command, language, error_message).
         """
-        commands = []
-        lines = text.split('\n')
-        in_block = False
-        current_block = []
-        current_language = None
-        valid_languages = {'bash', 'python'}
-
-        for line in lines:
-            stripped = line.strip()
-
-            if stripped.startswith('```') and not in_block:
-                # Extract the language specification
-                language = stripped[3:].strip().lower()
-                if language in valid_languages:
-                    in_block = True
-                    current_block = []
-                    current_language = language
-            elif stripped == '```' and in_block:
-                if current_block and current_language:
-                    command = '\n'.join(current_block).strip()
-                    if command:
-                        if validate:
-                            is_valid, error_msg = self.test_command(command, current_language)
-                            commands.append((command, current_language, error_msg))
-                        else:
-                            commands.append((command, current_language, ""))
-                in_block = False
-                current_block = []
-                current_language = None
-            elif in_block:
-                current_block.append(line)
-
-        return commands
-
-    def get_valid_commands(self, text: str) -> List[Tuple[str, str]]:
-        """
-        Extract only the syntactically valid commands.
-        Returns a list of tuples: (command, language)
-        """
-        all_commands = self.extract_commands(text, validate=True)
-        return [(cmd, lang) for cmd, lang, err in all_commands if not err]
+        # Most conversational replies have no code at all
+        first_fence = text.find('```')
+        if first_fence == -1:
+            return []
+
+        blocks = []
+
+        # Start scanning at the line holding the first fence so the prose
+        # before it is never fed through the regex
+        start = text.rfind('\n', 0, first_fence) + 1
+        for match in self._FENCE_RE.finditer(text, start):
+            language = match.group(1).lower()
+            language = self._LANGUAGE_ALIASES.get(language, language)
+            command = match.group(2).strip()
+            if command:
+                blocks.append((command, language))
+
+        if not validate:
+            return [(command, language, "") for command, language in blocks]
+
+        # Each block is checked on its own: parser state such as an open
+        # quote or heredoc must not carry over into the next block
+        return [(command, language, self.test_command(command, language)[1])
+                for command, language in blocks]
 
     def add_interaction(self, message: str, response: str) -> None:
         """Add a user-assistant interaction to the history."""
         self.session_history.append({
             'user': message,
             'assistant': response,
-            'commands': self.extract_commands(response)
+            # Parsed and validated once here; readers reuse this result
+            'commands': tuple(self.extract_commands(response))
         })
+        self._append_api_messages(message, response)
+
+    def _append_api_messages(self, message: str, response: str) -> None:
+        self._api_messages.append({"role": "user", "content": message})
+        self._api_messages.append({"role": "assistant", "content": response})
+        if len(self._api_messages) > 2 * self.API_CONTEXT_INTERACTIONS:
+            del self._api_messages[:2 * self.API_CONTEXT_TRIM_STEP]
 
-    def get_messages_for_api(self) -> List[Dict]:
-        """Convert history into format suitable for API messages."""
-        messages = []
-        for interaction in self.session_history[-10:]:  # Limit to last 10 messages
-            messages.extend([
-                {"role": "user", "content": interaction['user']},
-                {"role": "assistant", "content": interaction['assistant']}
-            ])
-        return messages
+    @classmethod
+    def estimate_tokens(cls, text: str) -> int:
+        """Cheap local token estimate, good enough for budgeting requests."""
+        return len(text) // cls.CHARS_PER_TOKEN + 1
+
+    def estimate_context_tokens(self) -> int:
+        """Estimate the tokens the recent history adds to the next request."""
+        return sum(self.estimate_tokens(m['content']) for m in self._api_messages)
+
+    def get_messages_for_api(self, reserved_tokens: int = 0) -> List[Dict]:
+        """
+        Return the recent history in the format used for API messages.
+        The oldest exchanges are dropped until the history plus
+        reserved_tokens (system prompt and new message) fits the budget.
+        """
+        messages = list(self._api_messages)
+        budget = self.MAX_CONTEXT_TOKENS - reserved_tokens
+        total = self.estimate_context_tokens()
+        start = 0
+        # Messages are always added in user/assistant pairs
+        while total > budget and start < len(messages):
+            for m in messages[start:start + 2]:
+                total -= self.estimate_tokens(m['content'])
+            start += 2
+        return messages[start:]
+
+    def get_commands(self, index: int) -> List[Tuple[str, str]]:
+        """
+        Get the valid commands of the interaction at index.
+        Returns a list of tuples: (command, language)
+        """
+        interaction = self.session_history[index]
+        commands = interaction.get('commands')
+        if commands is None:
+            # Conversations saved before commands were stored: parse once
+            commands = interaction['commands'] = tuple(self.extract_commands(interaction['assistant']))
+        return [(cmd, lang) for cmd, lang, err in commands if not err]
 
     def get_last_commands(self) -> List[Tuple[str, str]]:
         """
@@ -185,88 +372,277 @@ class History:
         """
         if not self.session_history:
             return []
-        last_response = self.session_history[-1].get('assistant', '')
-        return self.get_valid_commands(last_response)
+        return self.get_commands(-1)
 
     def clear_history(self) -> None:
-        self.session_history = []
+        self.session_history.clear()
+        self._api_messages.clear()
 
     def save_conversation(self, filename: str) -> None:
-        with open(filename, 'w') as f:
-            json.dump(self.session_history, f)
+        with open(filename, 'wb') as f:
+            f.write(json_dumps(list(self.session_history)))
 
     def load_conversation(self, filename: str) -> None:
-        with open(filename, 'r') as f:
-            self.session_history = json.load(f)
+        with open(filename, 'rb') as f:
+            self.session_history = collections.deque(json_loads(f.read()),
+                                                     maxlen=self.MAX_SESSION_INTERACTIONS)
+
+        self._api_messages.clear()
+        start = max(len(self.session_history) - self.API_CONTEXT_INTERACTIONS, 0)
+        for interaction in itertools.islice(self.session_history, start, None):
+            self._append_api_messages(interaction['user'], interaction['assistant'])
 
 class API:
-    def __init__(self, api_key: str, token_usage: TokenUsage, timeout: int = 30):
+    MESSAGES_URL = "https://api.anthropic.com/v1/messages"
+    # Fields shared by every request; send_message adds the rest
+    _BODY_BASE = {
+        "model": "claude-3-5-sonnet-20241022",
+        "max_tokens": 1024
+    }
+
+    def __init__(self, api_key: str, token_usage: TokenUsage, timeout: int = 30,
+                 prompt_caching: bool = True, response_cache: Optional[ResponseCache] = None):
         self.api_key = api_key
         self.timeout = timeout
         self.token_usage = token_usage
+        self.prompt_caching = prompt_caching
+        self.response_cache = response_cache
+
+        # requests is imported here rather than at module load, so --help
+        # stays fast and Config.check_dependencies can report it missing
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # Reuse one keep-alive connection across turns instead of paying a
+        # fresh TCP + TLS handshake for every message. The session's default
+        # Accept-Encoding already offers br/zstd when brotli/zstandard are
+        # installed, so responses arrive with the best compression available.
+        self.session = requests.Session()
+        # Bodies are encoded by json_dumps (orjson when available) and sent
+        # as data=, so the content type is set here once for every request
+        self.session.headers.update({
+            "x-api-key": api_key,
+            "anthropic-version": "2023-06-01",
+            "content-type": "application/json"
+        })
+        if prompt_caching:
+            self.session.headers["anthropic-beta"] = "prompt-caching-2024-07-31"
+        # Only one host is ever contacted; a small pool keeps its connection
+        # warm while still allowing a few concurrent requests. Rate limits,
+        # overloads (529) and transient server errors are retried on the same
+        # pooled connection, waiting as long as a Retry-After header asks
+        # (a request that fails mid-response is not resent).
+        retries = Retry(
+            total=3,
+            read=0,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504, 529],
+            allowed_methods=frozenset(['POST']),
+            raise_on_status=False
+        )
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retries))
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        self.session.close()
+        if self.response_cache is not None:
+            self.response_cache.close()
+
+    def warm_up(self) -> None:
+        """
+        Open the pooled connection in the background, so the TCP and TLS
+        handshakes overlap with the user typing instead of delaying the
+        first reply.
+        """
+        threading.Thread(target=self._open_connection, daemon=True).start()
+
+    def _open_connection(self) -> None:
+        import requests
+
+        try:
+            with self.session.head("https://api.anthropic.com/", timeout=self.timeout):
+                pass
+        except requests.RequestException:
+            pass  # The real request will report any problem
+
+    def send_message(self, message: str, system: str, previous_messages: List[Dict] = None,
+                     on_text: Optional[Callable[[str], None]] = None) -> Tuple[str, int]:
+        """
+        Send a message and return (response_text, tokens_used).
+
+        When on_text is given the reply is streamed and each text delta is
+        passed to it as soon as it arrives.
+        """
+        import requests
 
-    def send_message(self, message: str, system: str, previous_messages: List[Dict] = None) -> Tuple[str, int]:
         if previous_messages is None:
             previous_messages = []
 
+        if self.prompt_caching:
+            previous_messages = self._mark_cacheable(previous_messages)
+
+        payload = {
+            **self._BODY_BASE,
+            "system": system,
+            "messages": [*previous_messages, {"role": "user", "content": message}]
+        }
+
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.key(payload)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                if on_text is not None:
+                    on_text(cached)
+                return cached, 0
+
         try:
-            response = requests.post(
-                "https://api.anthropic.com/v1/messages",
-                headers={
-                    "x-api-key": self.api_key,
-                    "anthropic-version": "2023-06-01",
-                    "content-type": "application/json"
-                },
-                json={
-                    "model": "claude-3-5-sonnet-20241022",
-                    "max_tokens": 1024,
-                    "system": system,
-                    "messages": previous_messages + [{"role": "user", "content": message}]
-                },
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            data = response.json()
+            if on_text is not None:
+                text, input_tokens, output_tokens = self._stream_message(payload, on_text)
+            else:
+                response = self.session.post(
+                    self.MESSAGES_URL,
+                    data=json_dumps(payload),
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+                data = json_loads(response.content)
+
+                # Extract token usage from response
+                usage = data.get('usage', {})
+                input_tokens = self._input_tokens(usage)
+                output_tokens = usage.get('output_tokens', 0)
+                text = ''.join(block.get('text', '') for block in data['content']
+                               if block.get('type') == 'text')
 
-            # Extract token usage from response
-            usage = data.get('usage', {})
-            input_tokens = usage.get('input_tokens', 0)
-            output_tokens = usage.get('output_tokens', 0)
             total_tokens = input_tokens + output_tokens
 
             # Update token usage
             self.token_usage.add_tokens(total_tokens)
 
-            return data['content'][0]['text'], total_tokens
+            if cache_key is not None:
+                self.response_cache.put(cache_key, text)
+
+            return text, total_tokens
 
         except requests.Timeout:
             return "Error: Request timed out. Please try again.", 0
         except requests.RequestException as e:
             return f"Error: API request failed - {str(e)}", 0
 
+    @staticmethod
+    def _mark_cacheable(previous_messages: List[Dict]) -> List[Dict]:
+        """
+        Add a prompt-caching breakpoint after the latest history message, so
+        the server can reuse the system prompt and history for the next turn
+        instead of processing them again. The system prompt alone is below
+        the minimum cacheable length, so it gets no breakpoint of its own;
+        prefixes too short to be cached are simply processed as usual.
+        """
+        if not previous_messages:
+            return previous_messages
+        last = previous_messages[-1]
+        # A marked copy; the history's own message dicts stay plain
+        return previous_messages[:-1] + [{
+            "role": last["role"],
+            "content": [{"type": "text", "text": last["content"],
+                         "cache_control": {"type": "ephemeral"}}]
+        }]
+
+    def _input_tokens(self, usage: Dict) -> int:
+        """
+        Input tokens of a request, including those written to or read from
+        the cache. The cached ones are recorded too, as they are priced
+        differently.
+        """
+        written = usage.get('cache_creation_input_tokens', 0)
+        read = usage.get('cache_read_input_tokens', 0)
+        self.token_usage.add_cache_tokens(written, read)
+        return usage.get('input_tokens', 0) + written + read
+
+    # Stream events that carry nothing the client uses
+    _IGNORED_EVENTS = frozenset([b'ping', b'content_block_start', b'content_block_stop', b'message_stop'])
+
+    def _stream_message(self, payload: Dict, on_text: Callable[[str], None]) -> Tuple[str, int, int]:
+        """
+        Consume the server-sent event stream for a message.
+        Returns a tuple of (text, input_tokens, output_tokens).
+        """
+        import requests
+
+        chunks = []
+        input_tokens = output_tokens = 0
+
+        with self.session.post(
+            self.MESSAGES_URL,
+            data=json_dumps({**payload, "stream": True}),
+            timeout=self.timeout,
+            stream=True
+        ) as response:
+            response.raise_for_status()
+
+            event_name = None
+            for line in response.iter_lines():
+                if line.startswith(b'event:'):
+                    event_name = line[6:].strip()
+                    continue
+                if not line.startswith(b'data:'):
+                    continue
+                # Each data line follows an "event:" line naming its type, so
+                # pings and block start/stop markers are never decoded
+                if event_name in self._IGNORED_EVENTS:
+                    continue
+                event = json_loads(line[5:])
+                event_type = event.get('type')
+
+                if event_type == 'content_block_delta':
+                    text = event['delta'].get('text', '')
+                    if text:
+                        chunks.append(text)
+                        on_text(text)
+                elif event_type == 'message_start':
+                    usage = event['message'].get('usage', {})
+                    input_tokens = self._input_tokens(usage)
+                    output_tokens = usage.get('output_tokens', 0)
+                elif event_type == 'message_delta':
+                    output_tokens = event.get('usage', {}).get('output_tokens', output_tokens)
+                elif event_type == 'error':
+                    raise requests.RequestException(event['error'].get('message', 'stream error'))
+
+        return ''.join(chunks), input_tokens, output_tokens
+
 class Executor:
+    # Programs that draw full-screen, page their output or read a password
+    # from the terminal, matched as whole words. Blocks naming one get a
+    # pseudo-terminal automatically; a false match only costs CRLF output.
+    _INTERACTIVE_RE = re.compile(
+        r'(?:^|[\s;&|(])(?:sudo|ssh|vi|vim|nvim|nano|emacs|less|more|man|top|htop|watch|fzf)'
+        r'(?=$|[\s;&|)])',
+        re.MULTILINE
+    )
+
     def __init__(self):
-        self.current_process = None
-        self.recording_file = None
+        # Every command owns its own process and output buffer, so several
+        # can be in flight at once; the interrupt handler stops all of them
+        self.running_processes = set()
         signal.signal(signal.SIGINT, self.handle_interrupt)
 
     def handle_interrupt(self, signum, frame):
-        if self.current_process:
+        # Only signal here; the thread running each command sees its output
+        # end and reaps it with wait(), so nothing blocks in the handler
+        if self.running_processes:
             print("\nTerminating command...")
-            try:
-                os.killpg(os.getpgid(self.current_process.pid), signal.SIGTERM)
-                self.current_process.wait()
-            except ProcessLookupError:
-                pass
-            except KeyboardInterrupt:
-                pass
-            finally:
-                self.current_process = None
+            for process in list(self.running_processes):
+                try:
+                    os.killpg(process.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
         else:
-            signal.signal(signal.SIGINT, signal.default_int_handler)
             raise KeyboardInterrupt
 
-    def execute_command(self, command: Union[str, Tuple[str, str]], capture_output: bool = True) -> Optional[str]:
+    def execute_command(self, command: Union[str, Tuple[str, str]], capture_output: bool = True,
+                        tty: Optional[bool] = None, echo: bool = True) -> Optional[str]:
         """
         Execute a command and optionally capture its output.
 
@@ -274,6 +650,12 @@ class Executor:
             command: Either a string (assumed to be bash) or a tuple of (command_string, language)
             capture_output: If True, returns the command output. If False, returns None
                           but still executes interactively.
+            tty: Run under a pseudo-terminal so the command sees a terminal.
+                 Otherwise captured output is read straight from a pipe.
+                 None decides per command with needs_terminal().
+            echo: Show the command and its output as it runs. Quiet runs only
+                  return the captured output, so concurrent commands do not
+                  interleave on the terminal.
         """
         # Convert string command to tuple format
         if isinstance(command, str):
@@ -290,68 +672,317 @@ class Executor:
             print("No command provided")
             return None
 
-        # Create temporary file with appropriate extension
-        file_extension = '.py' if language == 'python' else '.sh'
-        with tempfile.NamedTemporaryFile(mode='w', suffix=file_extension, delete=False) as tmp:
-            tmp.write(cmd)
-            tmp_path = tmp.name
+        if tty is None:
+            tty = self.needs_terminal(cmd, language)
 
         output = None
-        self.recording_file = None
+        process = None
+        master_fd = None
 
         try:
-            os.chmod(tmp_path, 0o755)
             env = os.environ.copy()
             env.pop('ANTHROPIC_API_KEY', None)
 
-            print(f"\nExecuting {language} command:\n{cmd}\n---")
+            if echo:
+                print(f"\nExecuting {language} command:\n{cmd}\n---")
+
+            # Create the execution command based on language; the block is
+            # passed inline with -c rather than written to a script file
+            interpreter = PYTHON_PATH if language == 'python' else BASH_PATH
+            exec_cmd = [interpreter, '-c', cmd]
+
+            if capture_output and not tty:
+                # Fast path: no terminal needed, so tee a plain pipe to
+                # stdout as it arrives
+                # start_new_session runs setsid() in C rather than through a
+                # Python preexec_fn, so CPython may spawn the child with
+                # vfork instead of copying our page tables with fork, and
+                # it stays safe to call from the parallel worker threads
+                process = subprocess.Popen(
+                    exec_cmd,
+                    env=env,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    start_new_session=True,
+                    bufsize=0
+                )
+            else:
+                # Run on a pseudo-terminal we own: output is forwarded to the
+                # screen and captured in memory, with no recording file
+                master_fd, process = self._spawn_on_pty(exec_cmd, env)
+            self.running_processes.add(process)
+
+            try:
+                captured = CaptureBuffer()
+                if master_fd is not None:
+                    self._pump_pty(master_fd, captured, echo)
+                else:
+                    self._pump_pipe(process, captured, echo)
 
-            # Create the execution command based on language
-            if language == 'python':
-                exec_cmd = f'python {tmp_path}'
-            else:  # bash
-                exec_cmd = f'bash {tmp_path}'
+                process.wait()
+                if echo and process.returncode != 0 and process.returncode != -signal.SIGTERM:
+                    print(f"Command failed with exit code {process.returncode}")
 
-            # Always use script for recording
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.typescript', delete=False) as rec:
-                self.recording_file = rec.name
+                # Only return the captured output if capture_output is True
+                if capture_output:
+                    output = captured.getvalue()
 
-            script_cmd = ['script', '-q', '-c', exec_cmd, self.recording_file]
+            except KeyboardInterrupt:
+                self.handle_interrupt(signal.SIGINT, None)
+                process.wait()
 
-            self.current_process = subprocess.Popen(
-                script_cmd,
+            return output
+
+        finally:
+            if master_fd is not None:
+                os.close(master_fd)
+            if echo:
+                print("---")
+            if process is not None:
+                if process.stdout is not None:
+                    process.stdout.close()
+                self.running_processes.discard(process)
+
+    @classmethod
+    def needs_terminal(cls, cmd: str, language: str = 'bash') -> bool:
+        """Heuristic: True if a bash block runs a program that wants a terminal."""
+        return language == 'bash' and cls._INTERACTIVE_RE.search(cmd) is not None
+
+    def run_session(self, argv: List[str], captured: CaptureBuffer) -> None:
+        """
+        Run an interactive program on a pseudo-terminal, with the user's
+        terminal attached, until it exits. Its transcript is collected
+        in captured as it goes.
+        """
+        env = os.environ.copy()
+        env.pop('ANTHROPIC_API_KEY', None)
+
+        master_fd, process = self._spawn_on_pty(argv, env)
+        self.running_processes.add(process)
+        try:
+            self._pump_pty(master_fd, captured, echo=True)
+            process.wait()
+        finally:
+            os.close(master_fd)
+            self.running_processes.discard(process)
+
+    @classmethod
+    def _spawn_on_pty(cls, argv: List[str], env: Dict[str, str]) -> Tuple[int, subprocess.Popen]:
+        """Start argv on a new pseudo-terminal, returning its master fd and the process."""
+        master_fd, slave_fd = pty.openpty()
+        try:
+            cls._copy_window_size(slave_fd)
+            process = subprocess.Popen(
+                argv,
                 env=env,
-                preexec_fn=os.setsid
+                stdin=slave_fd,
+                stdout=slave_fd,
+                stderr=slave_fd,
+                preexec_fn=cls._attach_controlling_tty
             )
+        except BaseException:
+            os.close(master_fd)
+            raise
+        finally:
+            os.close(slave_fd)
+        return master_fd, process
 
-            try:
-                self.current_process.wait()
-                if self.current_process.returncode != 0 and self.current_process.returncode != -signal.SIGTERM:
-                    print(f"Command failed with exit code {self.current_process.returncode}")
+    @staticmethod
+    def _copy_window_size(pty_fd: int) -> None:
+        """Give the pty the size of the user's terminal, if there is one."""
+        if sys.stdout.isatty():
+            winsize = fcntl.ioctl(sys.stdout.fileno(), termios.TIOCGWINSZ, b'\0' * 8)
+            fcntl.ioctl(pty_fd, termios.TIOCSWINSZ, winsize)
+
+    @staticmethod
+    def _attach_controlling_tty() -> None:
+        """
+        Child-side setup: new session with the pty (already on fd 0) as its
+        terminal. Claiming a controlling terminal has no Popen option, so pty
+        runs keep this preexec_fn and the plain fork it implies.
+        """
+        os.setsid()
+        fcntl.ioctl(0, termios.TIOCSCTTY, 0)
 
-                # Only read and return the recorded output if capture_output is True
-                if capture_output and self.recording_file and os.path.exists(self.recording_file):
-                    with open(self.recording_file, 'r', errors='replace') as f:
-                        output = f.read()
+    # How often the pipe reader checks whether the block has exited
+    PIPE_POLL_INTERVAL = 0.1
 
-            except KeyboardInterrupt:
-                self.handle_interrupt(signal.SIGINT, None)
+    @classmethod
+    def _pump_pipe(cls, process: subprocess.Popen, captured: CaptureBuffer, echo: bool) -> None:
+        """
+        Copy a block's piped output to the screen and the capture buffer
+        until the block exits. A background job it started may keep the pipe
+        open, so end of file cannot be waited for; once the block is gone,
+        only output already in the pipe is taken.
+        """
+        fd = process.stdout.fileno()
 
-            return output
+        def copy(chunk: bytes) -> None:
+            if echo:
+                sys.stdout.buffer.write(chunk)
+                sys.stdout.buffer.flush()
+            captured.append(chunk)
 
+        sys.stdout.flush()
+        while True:
+            ready, _, _ = select.select([fd], [], [], cls.PIPE_POLL_INTERVAL)
+            if ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    return
+                copy(chunk)
+            if process.poll() is not None:
+                break
+
+        # Bounded, so a background job that keeps writing cannot hold us here
+        for _ in range(MAX_CAPTURE // 65536):
+            ready, _, _ = select.select([fd], [], [], 0)
+            if not ready:
+                break
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            copy(chunk)
+
+    @classmethod
+    def _pump_pty(cls, master_fd: int, captured: CaptureBuffer, echo: bool) -> None:
+        """
+        Copy pty output to the screen and the capture buffer, and keystrokes
+        to the pty, until the command closes its terminal.
+        """
+        stdin_fd = sys.stdin.fileno()
+        stdout_fd = sys.stdout.fileno()
+        saved_mode = None
+        if os.isatty(stdin_fd):
+            # Raw mode hands every keystroke, Ctrl+C included, to the command
+            saved_mode = termios.tcgetattr(stdin_fd)
+            setraw(stdin_fd)
+
+        # Pass terminal resizes on, so full-screen programs redraw at the
+        # new size; setting the pty's size signals its foreground job
+        # Handlers can only be set from the main thread
+        forward_winch = threading.current_thread() is threading.main_thread()
+        if forward_winch:
+            saved_winch = signal.signal(
+                signal.SIGWINCH, lambda signum, frame: cls._copy_window_size(master_fd))
+
+        sys.stdout.flush()
+        read_fds = [master_fd, stdin_fd]
+        try:
+            while True:
+                ready, _, _ = select.select(read_fds, [], [])
+                if master_fd in ready:
+                    try:
+                        data = os.read(master_fd, 65536)
+                    except OSError:  # EIO once the command's side is closed
+                        data = b''
+                    if not data:
+                        break
+                    if echo:
+                        os.write(stdout_fd, data)
+                    captured.append(data)
+                if stdin_fd in ready:
+                    data = os.read(stdin_fd, 1024)
+                    if data:
+                        os.write(master_fd, data)
+                    else:
+                        # Input ended: pass EOF on to the command
+                        read_fds.remove(stdin_fd)
+                        os.write(master_fd, b'\x04')
         finally:
-            try:
-                os.unlink(tmp_path)
-                if self.recording_file and os.path.exists(self.recording_file):
-                    os.unlink(self.recording_file)
-            except OSError:
-                pass
-            print("---")
-            self.current_process = None
-            self.recording_file = None
+            if forward_winch:
+                # None means the old handler was not set from Python
+                signal.signal(signal.SIGWINCH,
+                              signal.SIG_DFL if saved_winch is None else saved_winch)
+            if saved_mode is not None:
+                termios.tcsetattr(stdin_fd, termios.TCSAFLUSH, saved_mode)
+
+HELP_COMMANDS = (
+    ("!exit", "Exit the program"),
+    ("!clear", "Clear current session history"),
+    ("!run [n]", "Run command block n (default: 1)"),
+    ("!run all", "Run all command blocks"),
+    ("!run parallel", "Run all command blocks concurrently"),
+    ("!run select", "Choose command block interactively"),
+    ("!run --tty ...", "Run blocks under a terminal (for interactive programs)"),
+    ("!bash / !python", "Start a bash or python interactive session"),
+    ("!share", "Share last command output with Claude"),
+    ("!share full", "Share without trimming long outputs"),
+    ("!save <file>", "Save current session to file"),
+    ("!load <file>", "Load conversation from file"),
+    ("!tokens", "Show token usage, cost and next request size"),
+    ("Ctrl+C", "Stop running command"),
+    ("Ctrl+D", "Exit the program"),
+    ("Up/Down", "Navigate command history"),
+)
+
+def _build_help_markup(commands) -> str:
+    """Lay out the command table as one rich markup string."""
+    def escape(text: str) -> str:
+        # A literal '[' would otherwise open a markup tag, as in "!run [n]"
+        return text.replace("[", "\\[")
+
+    width = max(len(cmd) for cmd, _ in commands) + 2
+    rows = "".join(
+        f"  [cyan]{escape(f'{cmd:<{width}}')}[/cyan][white]{escape(desc)}[/white]\n"
+        for cmd, desc in commands
+    )
+    return "[bold yellow]Commands:[/bold yellow]\n" + rows
+
+HELP_MARKUP = _build_help_markup(HELP_COMMANDS)
 
 class StyledCLI:
-    def __init__(self):
+    # Bash that writes files, downloads, unpacks or builds, installs
+    # packages, changes a git checkout, escalates with sudo, or redirects
+    # into a file may affect the blocks after it, so such blocks are never
+    # run concurrently. A cd only moves its own block's shell. Duplicating
+    # a descriptor (2>&1) or discarding to /dev/null is harmless.
+    _ORDER_DEPENDENT_RE = re.compile(r'''
+        (?:^|[\s;&|(`])
+        (?:
+            (?:rm|rmdir|mv|cp|tee|touch|mkdir|ln|chmod|chown|truncate|dd|install|sudo
+              |wget|tar|unzip|gunzip|patch|rsync|make|cmake|virtualenv
+              |apt|apt-get|dnf|yum|pacman|zypper|brew|snap|pip|pip3|npm|yarn|pnpm|cargo|gem|conda)
+            (?=$|[\s;&|)`])
+          | sed\s(?:[^;&|\n]*\s)?-[a-zA-Z]*i
+          | curl\s(?:[^;&|\n]*\s)?(?:-[a-zA-Z]*[oO]|--output|--remote-name)
+          | python[\d.]*\s+-m\s+(?:venv|pip)(?=$|[\s;&|)`])
+          | git\s+(?:\S+\s+)*?(?:add|commit|checkout|switch|merge|rebase|reset|restore
+              |pull|push|fetch|clone|init|rm|mv|stash|tag|branch|cherry-pick|revert|apply|clean)
+            (?=$|[\s;&|)`])
+        )
+      | >(?!&|\s*/dev/null)
+    ''', re.MULTILINE | re.VERBOSE)
+
+    def __init__(self, interactive: bool = True):
+        self.config = Config()
+        response_cache = None
+        if os.getenv('CLAUDE_CLI_RESPONSE_CACHE') == '1':
+            response_cache = ResponseCache(self.config.history_dir / 'responses.sqlite')
+        self.api = API(os.getenv('ANTHROPIC_API_KEY'), self.config.token_usage,
+                       prompt_caching=os.getenv('CLAUDE_CLI_PROMPT_CACHE', '1') != '0',
+                       response_cache=response_cache)
+        self.history = History()
+        self.executor = Executor()
+        self.command_outputs = []
+
+        # Blocks and !bash run in child processes, so nothing changes this
+        # process's directory; read it once for the prompts
+        self._cwd = os.getcwd()
+        self._select_session = None
+
+        # prompt_toolkit and rich are only needed by the REPL; one-shot
+        # messages skip importing them altogether
+        if interactive:
+            self._init_interactive()
+
+    def _init_interactive(self) -> None:
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.formatted_text import HTML
+        from prompt_toolkit.history import FileHistory, ThreadedHistory
+        from prompt_toolkit.styles import Style
+        from rich.console import Console
+
         self.console = Console()
         self.style = Style.from_dict({
             'prompt': '#666666',    # Subtle gray for brackets
@@ -362,70 +993,43 @@ class StyledCLI:
             'tokens': '#FFA500',    # Orange color for token info
         })
 
-        self.config = Config()
-        self.api = API(os.getenv('ANTHROPIC_API_KEY'), self.config.token_usage)
-        self.history = History()
-        self.executor = Executor()
-        self.command_outputs = []
+        display_cwd = self._cwd
+        # Replace home directory with ~
+        home = str(Path.home())
+        if display_cwd.startswith(home):
+            display_cwd = '~' + display_cwd[len(home):]
 
-        history_dir = Path.home() / '.claude-cli'
-        history_dir.mkdir(exist_ok=True)
+        # The directory never changes, so the prompt is built once here.
+        # HTML.format escapes the path, so '<' or '&' in it stays literal
+        self._prompt_html = HTML(
+            '<prompt>'
+            '[<username>claude</username>'
+            '<at>:</at>'
+            '<path>{}</path>]'
+            '<arrow>&gt;</arrow> '
+            '</prompt>'
+        ).format(display_cwd)
 
+        # ThreadedHistory loads and appends to the history file on a
+        # background thread, keeping disk I/O off the input path
         self.session = PromptSession(
-            history=FileHistory(str(Path.home() / '.claude-cli' / 'command_history')),
+            history=ThreadedHistory(FileHistory(str(self.config.history_dir / 'command_history'))),
             style=self.style
         )
 
-    def get_styled_prompt(self) -> HTML:
-        username = os.getenv('USER', 'user')
-        hostname = os.uname().nodename
-        cwd = os.getcwd()
-        home = str(Path.home())
-
-        # Replace home directory with ~
-        if cwd.startswith(home):
-            cwd = '~' + cwd[len(home):]
-
-        return HTML(
-            '<prompt>'
-            '?<username>claude</username>'
-            '<at>:</at>'
-            '<path>{}</path>?'
-            '<arrow>?</arrow> '
-            '</prompt>'.format(cwd)
-        )
+    def get_styled_prompt(self) -> 'HTML':
+        return self._prompt_html
 
     def print_welcome(self):
+        from rich.panel import Panel
+        from rich.text import Text
+
         welcome_text = Text()
         welcome_text.append("Claude CLI", style="bold cyan")
         welcome_text.append(" - Interactive Mode\n\n", style="dim")
 
-        commands = [
-            ("!exit", "Exit the program"),
-            ("!clear", "Clear current session history"),
-            ("!run [n]", "Run command block n (default: 1)"),
-            ("!run all", "Run all command blocks"),
-            ("!run select", "Choose command block interactively"),
-            ("!bash / !python", "Start a bash or python interactive session"),
-            ("!share", "Share last command output with Claude"),
-            ("!save <file>", "Save current session to file"),
-            ("!load <file>", "Load conversation from file"),
-            ("!tokens", "Show token usage and cost"),
-            ("Ctrl+C", "Stop running command"),
-            ("Ctrl+D", "Exit the program"),
-            ("Up/Down", "Navigate command history")
-        ]
-
-        max_cmd_length = max(len(cmd[0]) for cmd in commands)
-        help_text = Text()
-        help_text.append("Commands:\n", style="bold yellow")
-
-        for cmd, desc in commands:
-            help_text.append(f"  {cmd:<{max_cmd_length+2}}", style="cyan")
-            help_text.append(f"{desc}\n", style="white")
-
         panel = Panel(
-            help_text,
+            Text.from_markup(HELP_MARKUP),
             title="[bold]Available Commands",
             border_style="blue"
         )
@@ -434,6 +1038,9 @@ class StyledCLI:
         self.console.print(panel)
 
     def print_command_output(self, command: str, output: str):
+        from rich.panel import Panel
+        from rich.text import Text
+
         self.console.print(
             Panel(
                 Text(output),
@@ -448,6 +1055,42 @@ class StyledCLI:
     def print_success(self, message: str):
         self.console.print(f"[bold green]Success:[/bold green] {message}")
 
+    def send_and_print(self, message: str) -> Tuple[Optional[str], int]:
+        """
+        Send a message with the conversation context and print the reply.
+        Replies are streamed as they arrive when stdout is a terminal.
+        Returns (None, 0) if the message was refused without being sent;
+        callers should then leave it out of the history.
+        """
+        system = self.config.get_system_prompt(self._cwd)
+        reserved = History.estimate_tokens(system) + History.estimate_tokens(message)
+        if reserved > History.MAX_CONTEXT_TOKENS:
+            # Don't spend a round trip on a request the API would reject
+            print(f"Error: Message is too long (~{_FMT_COMMA(reserved)} tokens, "
+                  f"limit ~{_FMT_COMMA(History.MAX_CONTEXT_TOKENS)})")
+            return None, 0
+
+        streamed = []
+
+        def on_text(text: str) -> None:
+            streamed.append(text)
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+        response, tokens = self.api.send_message(
+            message,
+            system,
+            self.history.get_messages_for_api(reserved),
+            on_text=on_text if sys.stdout.isatty() else None
+        )
+
+        if streamed:
+            print()
+        # Errors and non-streamed replies still need printing
+        if ''.join(streamed) != response:
+            print(response)
+        return response, tokens
+
     def handle_command(self, cmd: str) -> bool:
         try:
             if cmd.startswith("!run"):
@@ -463,6 +1106,9 @@ class StyledCLI:
             elif cmd == "!tokens":
                 print("\nCurrent Usage:")
                 print(self.config.token_usage.get_summary())
+                context_tokens = (History.estimate_tokens(self.config.get_system_prompt(self._cwd))
+                                  + self.history.estimate_context_tokens())
+                print(f"Next request context: ~{_FMT_COMMA(context_tokens)} tokens")
                 return True
             elif cmd == "!clear":
                 self.history.clear_history()
@@ -495,26 +1141,29 @@ class StyledCLI:
             elif cmd.startswith("!share"):
                 parts = cmd.split(maxsplit=1)
                 additional_context = parts[1] if len(parts) > 1 else ""
+                # "!share full" sends whole outputs; by default long ones
+                # are trimmed to their start and end
+                full = additional_context == "full" or additional_context.startswith("full ")
+                if full:
+                    additional_context = additional_context[len("full"):].strip()
 
                 if self.command_outputs:
                     # Format multiple outputs with block numbers
-                    formatted_outputs = "\n\n".join([
-                        f"Output from block {block_num}:\n```\n{output}\n```"
+                    formatted_outputs = "\n\n".join(
+                        f"Output from block {block_num}:\n```\n"
+                        f"{output if full else truncate_middle(output)}\n```"
                         for block_num, output in self.command_outputs
-                    ])
+                    )
 
                     # Combine the outputs with any additional context
                     message = f"Here is the output from my commands:\n\n{formatted_outputs}"
                     if additional_context:
                         message = f"{additional_context}\n\n{message}"
 
-                    response, tokens = self.api.send_message(
-                        message,
-                        self.config.get_system_prompt(),
-                        self.history.get_messages_for_api()
-                    )
-                    print(response)
-                    print(f"\n[tokens]Tokens used in this interaction: {tokens:,}[/tokens]")
+                    response, tokens = self.send_and_print(message)
+                    if response is None:
+                        return True
+                    print(TOKENS_USED_PREFIX + _FMT_COMMA(tokens) + TOKENS_USED_SUFFIX)
                     self.history.add_interaction(
                         f"Command outputs with context: {additional_context}\n{formatted_outputs}",
                         response
@@ -534,9 +1183,17 @@ class StyledCLI:
         Handle the !run command with various arguments:
         - number: Run specific block
         - 'all': Run all blocks
+        - 'parallel' (or 'all --parallel'): Run all blocks concurrently
         - 'select': Interactively select block
         - raw command: Execute as bash command
+        Any of these may be prefixed with '--tty' to run under a terminal;
+        otherwise blocks that look interactive get one automatically.
         """
+        tty = None
+        if block_spec == "--tty" or block_spec.startswith("--tty "):
+            tty = True
+            block_spec = block_spec[len("--tty"):].strip() or "1"
+
         commands = self.history.get_last_commands()
         if not commands:
             print("No commands found in last response")
@@ -546,12 +1203,23 @@ class StyledCLI:
 
         # Handle "all" command blocks
         if block_spec == "all":
-            self._run_all_blocks(commands)
+            self._run_all_blocks(commands, tty)
+            return
+
+        if block_spec in ("parallel", "all --parallel"):
+            if tty or any(self.executor.needs_terminal(cmd, lang) for cmd, lang in commands):
+                print("Parallel runs cannot share the terminal; running blocks in sequence")
+                self._run_all_blocks(commands, tty)
+            elif not self._blocks_are_independent(commands):
+                print("Some blocks may change files; running blocks in sequence")
+                self._run_all_blocks(commands, tty)
+            else:
+                self._run_all_blocks_parallel(commands)
             return
 
         # Handle interactive selection
         if block_spec == "select":
-            self._run_interactive_selection()
+            self._run_interactive_selection(tty)
             return
 
         # Handle numeric block selection
@@ -559,7 +1227,7 @@ class StyledCLI:
             if block_spec.isdigit():
                 block_num = int(block_spec)
                 if 1 <= block_num <= len(commands):
-                    output = self.executor.execute_command(commands[block_num - 1], capture_output=True)
+                    output = self.executor.execute_command(commands[block_num - 1], capture_output=True, tty=tty)
                     if output:
                         self.command_outputs.append((block_num, output))
                 else:
@@ -571,25 +1239,53 @@ class StyledCLI:
         # If we get here, treat as direct bash command
         is_valid, error_msg = self.history.test_command(block_spec)
         if is_valid:
-            output = self.executor.execute_command((block_spec, 'bash'), capture_output=True)
+            output = self.executor.execute_command((block_spec, 'bash'), capture_output=True, tty=tty)
             if output:
                 self.command_outputs.append((-1, output))
         else:
             print(f"Invalid bash command: {error_msg}")
 
-    def _run_all_blocks(self, commands: List[Tuple[str, str]]) -> None:
+    def _run_all_blocks(self, commands: List[Tuple[str, str]], tty: Optional[bool] = None) -> None:
         """Execute all command blocks in sequence."""
         for i, cmd in enumerate(commands, 1):
             print(f"\nExecuting block {i}:")
             try:
-                output = self.executor.execute_command(cmd, capture_output=True)
+                output = self.executor.execute_command(cmd, capture_output=True, tty=tty)
                 if output:
                     self.command_outputs.append((i, output))
             except KeyboardInterrupt:
                 print("\nExecution stopped by user")
                 break
 
-    def _run_interactive_selection(self) -> None:
+    @classmethod
+    def _blocks_are_independent(cls, commands: List[Tuple[str, str]]) -> bool:
+        """
+        Heuristic: True if no block looks like it affects the others. Python
+        blocks are not inspected; any of them makes the run sequential.
+        """
+        return not any(lang != 'bash' or cls._ORDER_DEPENDENT_RE.search(cmd)
+                       for cmd, lang in commands)
+
+    def _run_all_blocks_parallel(self, commands: List[Tuple[str, str]]) -> None:
+        """Execute independent command blocks concurrently, showing each as it finishes."""
+        results = []
+        # Output is captured, not echoed, so finished blocks print whole
+        run = functools.partial(self.executor.execute_command,
+                                capture_output=True, tty=False, echo=False)
+        with ThreadPoolExecutor(max_workers=min(4, len(commands))) as pool:
+            futures = {pool.submit(run, cmd): i for i, cmd in enumerate(commands, 1)}
+            print(f"\nRunning {len(commands)} blocks in parallel...")
+            for future in as_completed(futures):
+                i = futures[future]
+                output = future.result()
+                self.print_command_output(f"block {i}", output or "")
+                if output:
+                    results.append((i, output))
+
+        # Keep outputs in block order for !share
+        self.command_outputs.extend(sorted(results))
+
+    def _run_interactive_selection(self, tty: Optional[bool] = None) -> None:
         """Handle interactive block selection from history."""
         history_index = len(self.history.session_history) - 1
 
@@ -600,7 +1296,7 @@ class StyledCLI:
                 context = "Current response"
             else:
                 interaction = self.history.session_history[history_index]
-                commands = self.history.get_valid_commands(interaction['assistant'])
+                commands = self.history.get_commands(history_index)
                 user_msg = interaction['user']
                 context = (user_msg[:50] + '...') if len(user_msg) > 50 else user_msg
 
@@ -611,7 +1307,7 @@ class StyledCLI:
                     print(f"\nBlock {i} ({lang}):\n{cmd_str}")
 
                 try:
-                    selection = input("\nSelect block number (or press Enter for older commands, 'q' to cancel): ").strip().lower()
+                    selection = self._prompt_selection(len(commands))
 
                     if selection == 'q':
                         print("Selection cancelled")
@@ -620,19 +1316,13 @@ class StyledCLI:
                         history_index -= 1
                         continue
 
-                    try:
-                        block_num = int(selection)
-                        if 1 <= block_num <= len(commands):
-                            output = self.executor.execute_command(commands[block_num-1], capture_output=True)
-                            if output:
-                                self.command_outputs.append((block_num, output))
-                            break
-                        else:
-                            print(f"Block number {selection} out of range")
-                    except ValueError:
-                        print(f"Invalid input: {selection}")
-
-                except KeyboardInterrupt:
+                    block_num = int(selection)
+                    output = self.executor.execute_command(commands[block_num-1], capture_output=True, tty=tty)
+                    if output:
+                        self.command_outputs.append((block_num, output))
+                    break
+
+                except (KeyboardInterrupt, EOFError):
                     print("\nSelection cancelled")
                     break
             else:
@@ -641,12 +1331,37 @@ class StyledCLI:
         if history_index < 0:
             print("No more commands found in history")
 
+    def _prompt_selection(self, block_count: int) -> str:
+        """
+        Ask for a block number, Enter or 'q'. Anything else is rejected in
+        place by the validator, so the caller only sees valid answers.
+        """
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.validation import Validator
+
+        # Separate from the main session so selections stay out of the
+        # command history file
+        if self._select_session is None:
+            self._select_session = PromptSession()
+
+        def is_valid(text: str) -> bool:
+            text = text.strip().lower()
+            return text in ('', 'q') or (text.isdigit() and 1 <= int(text) <= block_count)
+
+        validator = Validator.from_callable(
+            is_valid,
+            error_message=f"Enter a block number from 1 to {block_count}, Enter for older commands or 'q'",
+            move_cursor_to_end=True
+        )
+        return self._select_session.prompt(
+            "\nSelect block number (or press Enter for older commands, 'q' to cancel): ",
+            validator=validator,
+            validate_while_typing=False
+        ).strip().lower()
+
     def run_bash_command(self, command: Optional[str] = None) -> None:
         """Run a bash command or start an interactive bash session."""
-        env = os.environ.copy()
-        env.pop('ANTHROPIC_API_KEY', None)  # Don't expose API key to shell
-
-        if command and command.trim():
+        if command and command.strip():
             print(f"Running bash command: {command}")
             try:
                 output = self.executor.execute_command(command, capture_output=True)
@@ -667,57 +1382,48 @@ class StyledCLI:
             print("\nStarting interactive bash session (type 'exit' to return to Claude CLI)")
             print("---")
 
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.typescript', delete=False) as typescript:
-                try:
-                    shell = os.environ.get('SHELL', '/bin/bash')
-                    subprocess.run(['script', typescript.name, '-q'], env=env)
+            # The shell runs on our own pty, so its transcript is captured
+            # in memory as it is shown instead of recorded to a file
+            transcript = CaptureBuffer()
+            try:
+                shell = os.environ.get('SHELL', '/bin/bash')
+                self.executor.run_session([shell], transcript)
 
-                    with open(typescript.name, 'r', errors='replace') as f:
-                        session_output = f.read()
+                session_output = transcript.getvalue()
 
-                    self.history.add_interaction(
-                        "!bash (interactive session)",
-                        f"Bash session transcript:\n```\n{session_output}\n```"
-                    )
+                self.history.add_interaction(
+                    "!bash (interactive session)",
+                    f"Bash session transcript:\n```\n{session_output}\n```"
+                )
 
-                except KeyboardInterrupt:
-                    print("\nBash session terminated")
-                    with open(typescript.name, 'r', errors='replace') as f:
-                        session_output = f.read()
-                    self.history.add_interaction(
-                        "!bash (interactive session - interrupted)",
-                        f"Interrupted bash session transcript:\n```\n{session_output}\n```"
-                    )
-                finally:
-                    os.unlink(typescript.name)
+            except KeyboardInterrupt:
+                print("\nBash session terminated")
+                session_output = transcript.getvalue()
+                self.history.add_interaction(
+                    "!bash (interactive session - interrupted)",
+                    f"Interrupted bash session transcript:\n```\n{session_output}\n```"
+                )
             print("---")
 
     def interactive_mode(self):
+        self.api.warm_up()
         self.print_welcome()
 
         while True:
             try:
-                user_input = self.session.prompt(
-                    lambda: self.get_styled_prompt()
-                ).strip()
+                user_input = self.session.prompt(self.get_styled_prompt()).strip()
 
                 if not user_input:
                     continue
 
                 if not self.handle_command(user_input):
-                    # Get previous messages for context
-                    previous_messages = self.history.get_messages_for_api()
-
                     # Send message with conversation history
-                    response, tokens = self.api.send_message(
-                        user_input,
-                        self.config.get_system_prompt(),
-                        previous_messages
-                    )
-                    print(response)
+                    response, tokens = self.send_and_print(user_input)
+                    if response is None:
+                        continue
 
                     # Print token usage for this interaction
-                    print(f"\n[tokens]Tokens used in this interaction: {tokens:,}[/tokens]")
+                    print(TOKENS_USED_PREFIX + _FMT_COMMA(tokens) + TOKENS_USED_SUFFIX)
 
                     self.history.add_interaction(user_input, response)
 
@@ -732,28 +1438,25 @@ class StyledCLI:
                 self.print_error(str(e))
 
     def single_message_mode(self, message: str):
-        previous_messages = self.history.get_messages_for_api()
-        response, tokens = self.api.send_message(
-            message,
-            self.config.get_system_prompt(),
-            previous_messages
-        )
-        print(response)
-        print(f"\nTokens used: {tokens:,}")
+        response, tokens = self.send_and_print(message)
+        if response is None:
+            sys.exit(1)
+        print("\nTokens used: " + _FMT_COMMA(tokens))
         print(self.config.token_usage.get_summary())
 
 def main():
-    cli = StyledCLI()
+    # Answer --help before any setup so it needs no API key or UI imports
+    if len(sys.argv) > 1 and sys.argv[1] in ['-h', '--help']:
+        print("Usage: claude-cli [message]")
+        print("  No arguments: Enter interactive mode")
+        print("  -h, --help:  Show this help message")
+        sys.exit(0)
 
     if len(sys.argv) > 1:
-        if sys.argv[1] in ['-h', '--help']:
-            print("Usage: claude-cli [message]")
-            print("  No arguments: Enter interactive mode")
-            print("  -h, --help:  Show this help message")
-            sys.exit(0)
-        else:
-            cli.single_message_mode(' '.join(sys.argv[1:]))
+        cli = StyledCLI(interactive=False)
+        cli.single_message_mode(' '.join(sys.argv[1:]))
     else:
+        cli = StyledCLI()
         cli.interactive_mode()
 
 if __name__ == "__main__":
@@ -0,0 +1,48 @@
+"""Fence parsing vectors for History.extract_commands.
+
+The expected results are the ones the original line-by-line parser gave
+for the same input; ``sh`` and ``shell`` tags are the only additions.
+"""
+import importlib.util
+import os
+import unittest
+
+_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                     'claude-cli.py')
+_spec = importlib.util.spec_from_file_location('claude_cli', _PATH)
+claude_cli = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(claude_cli)
+
+F = '```'
+
+CASES = [
+    ('untagged', f"{F}\nls\n{F}\n", []),
+    ('bash', f"text\n{F}bash\necho hi\n{F}\n", [('echo hi', 'bash')]),
+    ('python', f"{F}python\nprint(1)\n{F}", [('print(1)', 'python')]),
+    ('mixed case tag', f"{F}Bash\nls -l\n{F}", [('ls -l', 'bash')]),
+    ('sh', f"{F}sh\nls\n{F}", [('ls', 'bash')]),
+    ('shell', f"{F}shell\nls\n{F}", [('ls', 'bash')]),
+    ('two blocks', f"{F}bash\nls\n{F}\nprose\n{F}python\nx = 1\n{F}\n",
+     [('ls', 'bash'), ('x = 1', 'python')]),
+    ('untagged between', f"{F}bash\nls\n{F}\n{F}\nout\n{F}\n{F}bash\npwd\n{F}",
+     [('ls', 'bash'), ('pwd', 'bash')]),
+    ('other tag', f"{F}text\nnot run\n{F}\n{F}bash\nls\n{F}", [('ls', 'bash')]),
+    ('crlf', f"{F}bash\r\necho a\r\n{F}\r\n", [('echo a', 'bash')]),
+    ('indented', f"  {F}bash\n  echo a\n  {F}\n", [('echo a', 'bash')]),
+    ('indented closer', f"{F}bash\necho a\n   {F}   \n", [('echo a', 'bash')]),
+    ('unclosed', f"{F}bash\necho a\n", []),
+    ('empty', f"{F}bash\n\n{F}", []),
+]
+
+
+class ExtractCommandsTest(unittest.TestCase):
+    def test_fences(self):
+        history = claude_cli.History()
+        for name, text, expected in CASES:
+            with self.subTest(name):
+                commands = history.extract_commands(text, validate=False)
+                self.assertEqual([(c, lang) for c, lang, _ in commands], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
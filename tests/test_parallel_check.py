@@ -0,0 +1,75 @@
+"""Vectors for the check that decides whether !run parallel may run blocks concurrently."""
+import importlib.util
+import os
+import unittest
+
+_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                     'claude-cli.py')
+_spec = importlib.util.spec_from_file_location('claude_cli', _PATH)
+claude_cli = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(claude_cli)
+
+independent = claude_cli.StyledCLI._blocks_are_independent
+
+ORDER_DEPENDENT = [
+    'rm -rf build',
+    'mkdir -p out && ls out',
+    'echo hi > notes.txt',
+    'ls >> log',
+    'echo hi | tee out.txt',
+    "sed -i 's/a/b/' file",
+    'sed -n 1p file && sed -Ei s/a/b/ file',
+    'sudo systemctl restart nginx',
+    'pip install requests',
+    'apt-get install -y curl',
+    'git checkout main',
+    'git -C repo commit -m x',
+    'wget https://example.com/a.tgz',
+    'curl -o x https://example.com',
+    'curl -fsSLO https://example.com/a.tgz',
+    'curl --output x https://example.com',
+    'tar xzf a.tgz',
+    'tar -C /tmp -xf a.tar',
+    'unzip a.zip',
+    'make',
+    'make -j4 install',
+    'python3 -m venv env',
+    'python -m pip install -U pip',
+    'cd src; make test',
+    'x=$(touch a)',
+]
+
+INDEPENDENT = [
+    'ls -la',
+    'echo hello',
+    'cat file 2>&1',
+    'grep foo * > /dev/null',
+    'cd /tmp && ls',
+    'git status',
+    'git log --oneline -5',
+    'sed -n 1,5p file',
+    'curl -s https://example.com',
+    'curl -sSL https://example.com | head',
+    'python3 --version',
+    'echo makefile',
+    'df -h',
+]
+
+
+class ParallelCheckTest(unittest.TestCase):
+    def test_order_dependent_bash(self):
+        for cmd in ORDER_DEPENDENT:
+            with self.subTest(cmd):
+                self.assertFalse(independent([('ls', 'bash'), (cmd, 'bash')]))
+
+    def test_independent_bash(self):
+        for cmd in INDEPENDENT:
+            with self.subTest(cmd):
+                self.assertTrue(independent([('ls', 'bash'), (cmd, 'bash')]))
+
+    def test_python_blocks_run_in_sequence(self):
+        self.assertFalse(independent([('ls', 'bash'), ('print(1)', 'python')]))
+
+
+if __name__ == '__main__':
+    unittest.main()